@@ -8,8 +8,7 @@ import networkx as nx
 import node2vec
 from gensim.models import Word2Vec
 from numpy import random
-from optimization import update_embeddings
-from optimization import update_sphere
+from optimization import fused_update
 from error import measure_penalty_error
 from error import measure_radial_error
 from error import total_negative_radial_error
@@ -98,8 +97,7 @@ def read_graph():
         G = nx.read_edgelist(args.input, nodetype=int, data=(('weight', float),), create_using=nx.DiGraph())
     else:
         G = nx.read_edgelist(args.input, nodetype=int, create_using=nx.DiGraph())
-        for edge in G.edges():
-            G[edge[0]][edge[1]]['weight'] = 1
+        nx.set_edge_attributes(G, values=1, name='weight')
 
     if not args.directed:
         G = G.to_undirected()
@@ -115,8 +113,7 @@ def read_line_graph():
         L = nx.read_edgelist(args.line_graph, nodetype=int, data=(('weight', float),), create_using=nx.DiGraph())
     else:
         L = nx.read_edgelist(args.line_graph, nodetype=int, data=False, create_using=nx.DiGraph())
-        for edge in L.edges():
-            L[edge[0]][edge[1]]['weight'] = 1
+        nx.set_edge_attributes(L, values=1, name='weight')
 
     if not args.directed:
         L = L.to_undirected()
@@ -131,72 +128,74 @@ def seeded_vector(seed_string, vector_size):
     return (once.rand(vector_size) - 0.5) / vector_size
 
 
-def initialize_params(embeddings, nodes, edges, neighbors, edge_map, vector_size):
+def initialize_params(embeddings, nodes, edge_idx, neighbors, node_to_index, vector_size):
     node_count = len(nodes)
-    centers = np.empty((node_count, vector_size), dtype=float)
-    for i in range(node_count):
-        n_i = nodes[i]
-        neigh_i = neighbors[n_i]
-        neigh_i_count = 0
-        center_i = np.zeros((1, vector_size))
-        for ind in range(len(neigh_i)):
-            key = (n_i, neigh_i[ind])
-            if key in edge_map.keys():
-                edge_index = edge_map[(n_i, neigh_i[ind])]
-            else:
-                edge_index = edge_map[(neigh_i[ind], n_i)]
-            if edge_index in edges:
-                embed_index = np.where(np.array(edges) == edge_index)[0][0]
-                center_i += embeddings[embed_index]
-                neigh_i_count += 1
-        if neigh_i_count > 0:
-            center_i = center_i / neigh_i_count
-            centers[i] = center_i
+    # Each edge embedding contributes to both endpoint centers, so two
+    # scatter-adds replace the per-node Python iteration over neighbors.
+    # float32 matches the Word2Vec vectors: half the memory traffic and
+    # twice the SIMD lanes in the distance kernels, no conversion round-trip
+    centers = np.zeros((node_count, vector_size), dtype=np.float32)
+    np.add.at(centers, edge_idx[:, 0], embeddings)
+    np.add.at(centers, edge_idx[:, 1], embeddings)
+    incident_count = np.bincount(edge_idx.ravel(), minlength=node_count)
+    centers /= np.maximum(incident_count, 1)[:, None]
 
     # # randomize centers vector by vector, rather than materializing a huge random matrix in RAM at once
     # for i in range(node_count):
     #     # construct deterministic seed from word AND seed argument
     #     centers[i] = seeded_vector(str(nodes[i]) + str(seed_c), vector_size)
 
-    radius = np.empty((node_count, 1), dtype=float)
-    for i in range(node_count):
-        neighbors_i = neighbors[nodes[i]]
-        distance_list = []
-        for neigh in neighbors_i:
-            neigh_node_ind = np.where(nodes == neigh)[0][0]
-            distance = np.linalg.norm(
-                centers[i].reshape(vector_size, 1) - centers[neigh_node_ind].reshape(vector_size, 1))
-            distance_list.append(distance)
-        radius[i] = np.max(np.array(distance_list))
+    # CSR adjacency in node-index space: neighbors of node i sit in
+    # indices[indptr[i]:indptr[i + 1]]
+    neigh_counts = np.array([len(neighbors[n]) for n in nodes])
+    indptr = np.concatenate(([0], np.cumsum(neigh_counts)))
+    indices = node_to_index[[neigh for n in nodes for neigh in neighbors[n]]]
+    src = np.repeat(np.arange(node_count), neigh_counts)
+
+    # All center-to-neighbor-center squared distances in one batched pass,
+    # then a segmented max per node instead of a Python list per node
+    diff = centers[src] - centers[indices]
+    dist_sq = np.einsum('ij,ij->i', diff, diff)
+    radius = np.sqrt(np.maximum.reduceat(dist_sq, indptr[:-1]))[:, None].astype(np.float32)
 
     return centers, radius
 
 
-def update_optimization_params(old_embeddings, new_embeddings, centers, radii, edge_map, nodes, edges, gamma, alpha=0.1, beta=0.1, eta=0.1):
-    penalty_embeddings = update_embeddings(old_embeddings, new_embeddings, centers, radii, edge_map, nodes, edges, beta=beta, eta=eta)
-    centers, radii = update_sphere(penalty_embeddings, centers, radii, edge_map, nodes, edges, alpha=alpha, beta=beta, eta=eta, gamma=gamma)
+def update_optimization_params(old_embeddings, new_embeddings, centers, radii, edge_idx, gamma, alpha=0.1, beta=0.1, eta=0.1):
+    penalty_embeddings = fused_update(old_embeddings, new_embeddings, centers, radii, edge_idx, gamma, alpha=alpha, beta=beta, eta=eta)
     # print("Center shape :: ", centers.shape)
     return penalty_embeddings, centers, radii
 
 
-def learn_embeddings(walks, edge_map, reverse_edge_map, nodes, neighbors):
+def learn_embeddings(walks, edge_endpoints, nodes, neighbors):
     '''
     Learn embeddings by optimizing the Skipgram objective using SGD.
     '''
 
-    walks = [map(str, walk) for walk in walks]
-    model = Word2Vec(walks, size=args.dimensions, window=args.window_size, min_count=0, sg=1, workers=args.workers,
-                     iter=args.iter)
-    # print(model.index2word)
+    # Materialized lists: map() iterators are one-shot, so Word2Vec's
+    # repeated passes over the corpus would silently see an empty corpus
+    walks = [[str(node) for node in walk] for walk in walks]
+    # Build the vocabulary once; every later train() call reuses it instead
+    # of rescanning the corpus
+    model = Word2Vec(vector_size=args.dimensions, window=args.window_size, min_count=0, sg=1, workers=args.workers)
+    model.build_vocab(walks)
+    model.train(walks, total_examples=model.corpus_count, epochs=args.iter)
+    # print(model.wv.index_to_key)
     print('Number of walks : ', len(walks))
 
     # List containing edge ids, embeddings of edges are stored in this order
-    edges = [int(word) for word in model.index2word]
-    # print('Model index2word :: ', model.index2word)
+    edges = [int(word) for word in model.wv.index_to_key]
+    # print('Model index_to_key :: ', model.wv.index_to_key)
+
+    # Dense node-id -> row-index lookup built once and reused everywhere;
+    # -1 marks ids that are not nodes of the graph
+    node_to_index = np.full(nodes.max() + 1, -1, dtype=np.int64)
+    node_to_index[nodes] = np.arange(len(nodes))
+    edge_idx = node_to_index[edge_endpoints[edges]].astype(np.int32)
 
     # Initialize params after first iteration of word2vec
-    cur_embeds = model.syn0
-    centers, radii = initialize_params(cur_embeds, nodes, edges, neighbors, edge_map, args.dimensions)
+    cur_embeds = model.wv.vectors
+    centers, radii = initialize_params(cur_embeds, nodes, edge_idx, neighbors, node_to_index, args.dimensions)
 
     # List containing penalty errors over iterations
     penalty_error_list = []
@@ -222,24 +221,25 @@ def learn_embeddings(walks, edge_map, reverse_edge_map, nodes, neighbors):
     # Start updating optimization variables using penalty method and collective homophily
     for i in range(args.l2v_iter):
         print('Iteration number %s' % (i+1))
-        old_centers = centers  # For rolling back in case penalty error increases
-        old_radii = radii  # For rolling back in case penalty error increases
-        old_embeddings = model.syn0
-        model.train(walks, total_examples=model.corpus_count)
-        new_embeddings = model.syn0
-
-        penalty_embeddings, centers, radii = update_optimization_params(old_embeddings, new_embeddings, centers, radii, reverse_edge_map, nodes, edges, gamma, alpha=alpha, beta=beta, eta=eta)
-        model.syn0 = penalty_embeddings
+        old_centers = centers.copy()  # For rolling back in case penalty error increases
+        old_radii = radii.copy()  # For rolling back in case penalty error increases
+        old_embeddings = model.wv.vectors.copy()
+        model.train(walks, total_examples=model.corpus_count, epochs=1)
+        new_embeddings = model.wv.vectors
+
+        # The fused update writes into new_embeddings, i.e. straight into
+        # model.wv.vectors, so the C training path sees the penalty step
+        penalty_embeddings, centers, radii = update_optimization_params(old_embeddings, new_embeddings, centers, radii, edge_idx, gamma, alpha=alpha, beta=beta, eta=eta)
         
-        #penalty_error = beta * measure_penalty_error(penalty_embeddings, centers, radii, reverse_edge_map, nodes, edges)
-        penalty_error = measure_penalty_error(penalty_embeddings, centers, radii, reverse_edge_map, nodes, edges)
+        #penalty_error = beta * measure_penalty_error(penalty_embeddings, centers, radii * np.abs(radii), edge_idx)
+        penalty_error = measure_penalty_error(penalty_embeddings, centers, radii * np.abs(radii), edge_idx)
         
         total_negative_error = total_negative_radial_error(radii)
 
         if i>10 and beta_update:
             if penalty_error >= 1.2*penalty_error_list[-1]:
                 beta_update = False
-                model.syn0 = old_embeddings
+                model.wv.vectors[:] = old_embeddings
                 centers = old_centers
                 radii = old_radii
                 beta /= 2
@@ -280,8 +280,8 @@ def learn_embeddings(walks, edge_map, reverse_edge_map, nodes, neighbors):
     with open(radii_fname, 'wb') as f:
         pickle.dump(radii_list, f, pickle.HIGHEST_PROTOCOL)
 
-    # print('Final embeds :: ', model.syn0)
-    model.save_word2vec_format(args.output)
+    # print('Final embeds :: ', model.wv.vectors)
+    model.wv.save_word2vec_format(args.output)
     return penalty_error_list, total_negative_error_list, radial_error_list, total_cost_list
 
 
@@ -305,114 +305,105 @@ def modify_edge_weights(G, epsilon=0.00001):
 
 
 def prepare_node_weights(G, edge_weight_dict):
-    node_weight_dict = {}
-    for node in G.nodes():
-        weight = 0
-        for neighbor in G.neighbors(node):
-            if (node, neighbor) in edge_weight_dict:
-                weight += edge_weight_dict[(node, neighbor)]
-            else:
-                weight += edge_weight_dict[(neighbor, node)]
-        node_weight_dict[node] = weight
-    return node_weight_dict
+    # Weighted degree = sum of incident edge weights: two bincounts over
+    # the edge-endpoint columns replace the per-neighbor dict probes with
+    # their (node, neighbor)/(neighbor, node) fallback
+    edge_arr = np.array(list(edge_weight_dict.keys()), dtype=np.int64)
+    weight_arr = np.fromiter(edge_weight_dict.values(), dtype=float, count=len(edge_weight_dict))
+    size = max(G.nodes()) + 1
+    node_weight_arr = np.bincount(edge_arr[:, 0], weights=weight_arr, minlength=size)
+    node_weight_arr += np.bincount(edge_arr[:, 1], weights=weight_arr, minlength=size)
+    return node_weight_arr
 
 
 def build_weighted_line_graph(G, L):
     degree_dict = dict(G.degree())
     edge_weight_dict = modify_edge_weights(G)
-    node_weight_dict = prepare_node_weights(G, edge_weight_dict)
-
-    line_graph_edge_weight_dict = {}
-    for line_graph_edge in L.edges():
-        original_graph_edge_1 = line_graph_edge[0]
-        original_graph_edge_2 = line_graph_edge[1]
-        common_vertex = set(original_graph_edge_1).intersection(set(original_graph_edge_2))
-        start_vertex = set(original_graph_edge_1).difference(common_vertex)
-        end_vertex = set(original_graph_edge_2).difference(common_vertex)
-        if len(common_vertex) == 1 and len(start_vertex) != 0 and len(end_vertex) != 0:
-            common_vertex = list(common_vertex)[0]
-            start_vertex = list(start_vertex)[0]
-            end_vertex = list(end_vertex)[0]
-        else:
-            # Handle the odd case of self-loops or parallel-edges
-            common_vertex = original_graph_edge_1[1]
-            start_vertex = original_graph_edge_1[0]
-            end_vertex = original_graph_edge_2[1]
-
-        degree_start_vertex_edge_1 = degree_dict[start_vertex]
-        degree_end_vertex_edge_1 = degree_dict[common_vertex]
-        if degree_start_vertex_edge_1 == 1:
-            weight_contri_src_edge_1 = 1
-        else:
-            weight_contri_src_edge_1 = float(degree_start_vertex_edge_1) / (
-                    degree_start_vertex_edge_1 + degree_end_vertex_edge_1)
-
-        weight_dest_edge = edge_weight_dict[original_graph_edge_2]
-        weight_src_edge = edge_weight_dict[original_graph_edge_1]
-        weighted_degree_common_vertex = node_weight_dict[common_vertex]
-        if (weighted_degree_common_vertex - weight_src_edge) == 0:
-            print('In impossible case!')
-            weight_contri_dest_edge_1 = 0
-        else:
-            weight_contri_dest_edge_1 = float(weight_dest_edge) / (weighted_degree_common_vertex - weight_src_edge)
-        line_graph_edge_weight_1 = weight_contri_src_edge_1 * weight_contri_dest_edge_1
-        #     line_graph_edge_weight_dict[line_graph_edge] = line_graph_edge_weight
-
-        degree_start_vertex_edge_2 = degree_dict[end_vertex]
-        degree_end_vertex_edge_2 = degree_dict[common_vertex]
-        if degree_end_vertex_edge_2 == 1:
-            weight_contri_src_edge_2 = 1
-        else:
-            weight_contri_src_edge_2 = float(degree_start_vertex_edge_2) / (
-                    degree_start_vertex_edge_2 + degree_end_vertex_edge_2)
-
-        weight_dest_edge = edge_weight_dict[original_graph_edge_1]
-        weight_src_edge = edge_weight_dict[original_graph_edge_2]
-        weighted_degree_common_vertex = node_weight_dict[common_vertex]
-        if (weighted_degree_common_vertex - weight_src_edge) == 0:
-            print('In impossible case!')
-            weight_contri_dest_edge_2 = 0
-        else:
-            weight_contri_dest_edge_2 = float(weight_dest_edge) / (weighted_degree_common_vertex - weight_src_edge)
-        line_graph_edge_weight_2 = weight_contri_src_edge_2 * weight_contri_dest_edge_2
-        line_graph_edge_weight_dict[line_graph_edge] = (line_graph_edge_weight_1 + line_graph_edge_weight_2) / 2
-    # print(line_graph_edge_weight_dict)
-    return line_graph_edge_weight_dict
+    node_weight_arr = prepare_node_weights(G, edge_weight_dict)
+
+    # Index original-graph edges once so the line-graph pass does plain
+    # array reads instead of repeated dict probes and set constructions
+    edge_list = list(edge_weight_dict.keys())
+    edge_weight_arr = np.array([edge_weight_dict[e] for e in edge_list])
+    max_node_id = max(degree_dict)
+    degree_arr = np.zeros(max_node_id + 1)
+    for node, degree in degree_dict.items():
+        degree_arr[node] = degree
+
+    # Line-graph edges as endpoint columns: (a, b) and (c, d) are the two
+    # original-graph edges joined by each line-graph edge
+    line_graph_edges = list(L.edges())
+    quads = np.array([(edge[0][0], edge[0][1], edge[1][0], edge[1][1])
+                      for edge in line_graph_edges], dtype=np.int64)
+    a, b, c, d = quads.T
+
+    # Resolve edge ids with one searchsorted over packed sorted-endpoint
+    # keys, so tuple orientation from nx.line_graph does not matter
+    base = max_node_id + 1
+    edge_arr = np.array(edge_list, dtype=np.int64)
+    edge_keys = np.minimum(edge_arr[:, 0], edge_arr[:, 1]) * base + np.maximum(edge_arr[:, 0], edge_arr[:, 1])
+    order = np.argsort(edge_keys)
+    sorted_keys = edge_keys[order]
+    edge_1 = order[np.searchsorted(sorted_keys, np.minimum(a, b) * base + np.maximum(a, b))]
+    edge_2 = order[np.searchsorted(sorted_keys, np.minimum(c, d) * base + np.maximum(c, d))]
+
+    # Common/start/end vertices by endpoint comparison instead of set
+    # algebra; the select order mirrors the old if/elif chain
+    normal = (a != b) & (c != d) & (
+            ((a == c).astype(int) + (a == d) + (b == c) + (b == d)) == 1)
+    common_vertex = np.select([a == c, a == d, b == c], [a, a, b], default=b)
+    start_vertex = np.select([a == c, a == d, b == c], [b, b, a], default=a)
+    end_vertex = np.select([a == c, a == d, b == c], [d, c, d], default=c)
+    # Handle the odd case of self-loops or parallel-edges
+    common_vertex = np.where(normal, common_vertex, b)
+    start_vertex = np.where(normal, start_vertex, a)
+    end_vertex = np.where(normal, end_vertex, d)
+
+    degree_common = degree_arr[common_vertex]
+    weighted_degree_common = node_weight_arr[common_vertex]
+    weight_edge_1 = edge_weight_arr[edge_1]
+    weight_edge_2 = edge_weight_arr[edge_2]
+
+    degree_start = degree_arr[start_vertex]
+    weight_contri_src_edge_1 = np.where(degree_start == 1, 1.0,
+                                        degree_start / (degree_start + degree_common))
+    degree_end = degree_arr[end_vertex]
+    weight_contri_src_edge_2 = np.where(degree_common == 1, 1.0,
+                                        degree_end / (degree_end + degree_common))
+
+    denom_1 = weighted_degree_common - weight_edge_1
+    denom_2 = weighted_degree_common - weight_edge_2
+    if np.any(denom_1 == 0) or np.any(denom_2 == 0):
+        print('In impossible case!')
+    weight_contri_dest_edge_1 = np.where(denom_1 == 0, 0.0,
+                                         weight_edge_2 / np.where(denom_1 == 0, 1.0, denom_1))
+    weight_contri_dest_edge_2 = np.where(denom_2 == 0, 0.0,
+                                         weight_edge_1 / np.where(denom_2 == 0, 1.0, denom_2))
+
+    line_graph_edge_weights = (weight_contri_src_edge_1 * weight_contri_dest_edge_1
+                               + weight_contri_src_edge_2 * weight_contri_dest_edge_2) / 2
+    # print(line_graph_edge_weights)
+    return dict(zip(line_graph_edges, line_graph_edge_weights))
 
 
 def map_edge_to_unique_index(G):
-    edge_map = {}
-    reverse_edge_map = {}
-    index = 0
-    # print(len(G.edges()))
-    for edge in G.edges():
-        edge_map[edge] = index
-        reverse_edge_map[index] = edge
-        index += 1
-    # print(edge_map)
-    # Save the edge map into a pickle file
+    edge_map = {edge: index for index, edge in enumerate(G.edges())}
+    # Endpoints indexed by edge id: replaces the pickled dicts with two
+    # int64 columns, 16 bytes per edge on disk and no unpickling cost
+    edge_endpoints = np.array(list(G.edges()), dtype=np.int64)
     base_path = os.path.dirname(args.input)
     print(base_path)
-    edge_to_node_id_dict_filename = os.path.join(base_path, 'edge_map.pkl')
-    with open(edge_to_node_id_dict_filename, 'wb') as edge_to_node_id_dict_file:
-        pickle.dump(edge_map, edge_to_node_id_dict_file, pickle.HIGHEST_PROTOCOL)
-
-    reverse_edge_to_node_id_dict_filename = os.path.join(base_path, 'reverse_edge_map.pkl')
-    with open(reverse_edge_to_node_id_dict_filename, 'wb') as reverse_edge_to_node_id_dict_file:
-        pickle.dump(reverse_edge_map, reverse_edge_to_node_id_dict_file, pickle.HIGHEST_PROTOCOL)
-    return edge_map, reverse_edge_map
+    edge_map_filename = os.path.join(base_path, 'edge_map.npz')
+    np.savez(edge_map_filename, u=edge_endpoints[:, 0], v=edge_endpoints[:, 1])
+    return edge_map, edge_endpoints
 
 
 def load_edge_map():
     base_path = os.path.dirname(args.input)
-    edge_to_node_id_dict_filename = os.path.join(base_path, 'edge_map.pkl')
-    with open(edge_to_node_id_dict_filename, 'rb') as edge_to_node_id_dict_file:
-        edge_map = pickle.load(edge_to_node_id_dict_file)
-
-    reverse_edge_to_node_id_dict_filename = os.path.join(base_path, 'reverse_edge_map.pkl')
-    with open(reverse_edge_to_node_id_dict_filename, 'rb') as reverse_edge_to_node_id_dict_file:
-        reverse_edge_map = pickle.load(reverse_edge_to_node_id_dict_file)
-    return edge_map, reverse_edge_map
+    edge_map_filename = os.path.join(base_path, 'edge_map.npz')
+    with np.load(edge_map_filename) as data:
+        edge_endpoints = np.column_stack((data['u'], data['v']))
+    return edge_endpoints
 
 
 def save_line_graph(L, edge_map, line_graph_edge_weight_dict):
@@ -483,22 +474,26 @@ def main(args):
 
     if args.scratch:
         nx_L = nx.line_graph(nx_G)
+        # nx.line_graph does not promise edge-tuple orientation, so relabel
+        # its nodes to the orientation G.edges() uses (edge_map is keyed on it)
+        canonical = {tuple(sorted(edge)): edge for edge in nx_G.edges()}
+        nx_L = nx.relabel_nodes(nx_L, {n: canonical[tuple(sorted(n))] for n in nx_L.nodes()})
         print("Number of nodes in the line graph : ", len(nx_L.nodes()))
         print("Number of edges in the line graph : ", len(nx_L.edges()))
         assert len(nx_G.edges()) == len(nx_L.nodes())
 
         line_graph_edge_weight_dict = build_weighted_line_graph(nx_G, nx_L)
-        edge_map, reverse_edge_map = map_edge_to_unique_index(nx_G)
+        edge_map, edge_endpoints = map_edge_to_unique_index(nx_G)
         # print(edge_map)
         save_line_graph(nx_L, edge_map, line_graph_edge_weight_dict)
 
     else:
-        edge_map, reverse_edge_map = load_edge_map()
+        edge_endpoints = load_edge_map()
 
     nx_L = read_line_graph()
     L = node2vec.Graph(nx_L, args.directed, args.p, args.q)
     L.preprocess_transition_probs()
-    walks = L.simulate_walks(args.num_walks, args.walk_length)
+    walks = L.simulate_walks(args.num_walks, args.walk_length, workers=args.workers)
 
     # Prepare a dictionary of nodes and their neighbours
     nodes = np.array(nx_G.nodes())
@@ -510,7 +505,7 @@ def main(args):
         neighbors[node] = neigh_n
 
     # Learn embeddings
-    penalty_error_list, total_negative_error_list, radial_error_list, total_cost_list = learn_embeddings(walks, edge_map, reverse_edge_map, nodes, neighbors)
+    penalty_error_list, total_negative_error_list, radial_error_list, total_cost_list = learn_embeddings(walks, edge_endpoints, nodes, neighbors)
     # plot_error(penalty_error_list, total_negative_error_list, radial_error_list, total_cost_list)
 
 
@@ -1,6 +1,8 @@
 import numpy as np
 import networkx as nx
 import random
+import multiprocessing
+import os
 
 
 class Graph():
@@ -36,19 +38,31 @@ class Graph():
 
 		return walk
 
-	def simulate_walks(self, num_walks, walk_length):
+	def simulate_walks(self, num_walks, walk_length, workers=1):
 		'''
 		Repeatedly simulate random walks from each node.
+		Walks are independent, so start nodes are sharded across workers;
+		the precomputed alias tables are shared read-only through fork.
 		'''
 		G = self.G
-		walks = []
 		nodes = list(G.nodes())
-		print 'Walk iteration:'
-		for walk_iter in range(num_walks):
-			print str(walk_iter+1), '/', str(num_walks)
-			random.shuffle(nodes)
-			for node in nodes:
-				walks.append(self.node2vec_walk(walk_length=walk_length, start_node=node))
+		print('Walk iteration:')
+		if workers > 1:
+			chunks = [nodes[i::workers] for i in range(workers)]
+			tasks = [(chunk, num_walks, walk_length) for chunk in chunks if chunk]
+			pool = multiprocessing.Pool(workers, initializer=_init_walk_worker, initargs=(self,))
+			walks = []
+			for chunk_walks in pool.imap_unordered(_simulate_walks_chunk, tasks):
+				walks.extend(chunk_walks)
+			pool.close()
+			pool.join()
+		else:
+			walks = []
+			for walk_iter in range(num_walks):
+				print(str(walk_iter+1), '/', str(num_walks))
+				random.shuffle(nodes)
+				for node in nodes:
+					walks.append(self.node2vec_walk(walk_length=walk_length, start_node=node))
 
 		return walks
 
@@ -104,6 +118,31 @@ class Graph():
 		return
 
 
+_walk_graph = None
+
+
+def _init_walk_worker(graph):
+	global _walk_graph
+	_walk_graph = graph
+	# Forked workers inherit the parent's numpy random state, and alias_draw
+	# samples every walk step from np.random — reseed so the shards draw
+	# independent streams instead of byte-identical ones
+	np.random.seed(int.from_bytes(os.urandom(4), 'little'))
+
+
+def _simulate_walks_chunk(task):
+	'''
+	Run every walk iteration for one shard of start nodes.
+	'''
+	nodes, num_walks, walk_length = task
+	walks = []
+	for walk_iter in range(num_walks):
+		random.shuffle(nodes)
+		for node in nodes:
+			walks.append(_walk_graph.node2vec_walk(walk_length=walk_length, start_node=node))
+	return walks
+
+
 def alias_setup(probs):
 	'''
 	Compute utility lists for non-uniform sampling from discrete distributions.
@@ -112,7 +151,7 @@ def alias_setup(probs):
 	'''
 	K = len(probs)
 	q = np.zeros(K)
-	J = np.zeros(K, dtype=np.int)
+	J = np.zeros(K, dtype=int)
 
 	smaller = []
 	larger = []
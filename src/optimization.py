@@ -1,67 +1,82 @@
-from scipy.optimize import minimize
 import numpy as np
+from numba import njit, prange
 
 
-def update_embeddings(old_embeddings, new_embeddings, centers, radii, edge_map, nodes, edges, beta=0.001, eta=0.1):
-    edge_count = old_embeddings.shape[0]
-    embed_dim = old_embeddings.shape[1]
-    # assert edge_count == len(edge_map.keys())  # False in case of isolated edges in the original graph
-    assert old_embeddings.shape[0] == new_embeddings.shape[0]
-    assert old_embeddings.shape[1] == new_embeddings.shape[1]
-    for i in range(edge_count):
-        edge = edge_map[edges[i]]
-        n_u = edge[0]
-        n_v = edge[1]
-        X_uv = old_embeddings[i]
-        n_u_ind = np.where(nodes == n_u)
-        n_v_ind = np.where(nodes == n_v)
-        c_u = centers[n_u_ind]
-        c_v = centers[n_v_ind]
-        r_u = radii[n_u_ind]
-        r_v = radii[n_v_ind]
-        dX_uv = np.zeros((1, embed_dim))
-        if np.linalg.norm(X_uv - c_u) > r_u:
-            dX_uv += 2 * beta * (X_uv - c_u)
-        if np.linalg.norm(X_uv - c_v) > r_v:
-            dX_uv += 2 * beta * (X_uv - c_v)
-        new_embeddings[i] = new_embeddings[i] - eta * dX_uv
-
-    return new_embeddings
+@njit(parallel=True, fastmath=True, cache=True)
+def _fused_update_kernel(old_embeddings, new_embeddings, centers, radii, radii_sq, edge_idx, gamma, alpha, beta, eta):
+    edge_count, embed_dim = old_embeddings.shape
+    node_count = centers.shape[0]
+    step = 2.0 * beta * eta
 
+    # Penalty pass: push each edge embedding toward the spheres it violates.
+    # Edges are independent here, so the loop runs in parallel.
+    # radii_sq is the signed square r*|r|, so dist > r_sq matches norm > r
+    # for negative radii as well.
+    for i in prange(edge_count):
+        n_u = edge_idx[i, 0]
+        n_v = edge_idx[i, 1]
+        dist_u_sq = 0.0
+        dist_v_sq = 0.0
+        for k in range(embed_dim):
+            x = old_embeddings[i, k]
+            d_u = x - centers[n_u, k]
+            d_v = x - centers[n_v, k]
+            dist_u_sq += d_u * d_u
+            dist_v_sq += d_v * d_v
+        outside_u = dist_u_sq > radii_sq[n_u]
+        outside_v = dist_v_sq > radii_sq[n_v]
+        # Once training settles most edges sit inside both spheres; they
+        # take the distance pass above and skip the write-back entirely
+        if outside_u or outside_v:
+            for k in range(embed_dim):
+                x = old_embeddings[i, k]
+                grad = 0.0
+                if outside_u:
+                    grad += x - centers[n_u, k]
+                if outside_v:
+                    grad += x - centers[n_v, k]
+                new_embeddings[i, k] -= step * grad
 
-def update_sphere(embeddings, centers, radii, edge_map, nodes, edges, alpha=0.1, beta=0.1, eta=0.1, gamma=None):
-    # Update radius and centers using gradients
-    node_count = len(nodes)
-    edge_count = embeddings.shape[0]
-    embed_dim = embeddings.shape[1]
-    dradii = np.zeros((node_count, 1))
-    dcenters = np.zeros((node_count, embed_dim))
+    # Sphere pass: accumulate center/radius gradients from the updated
+    # embeddings. Endpoints share nodes, so this scatter stays serial.
+    violations = np.zeros(node_count, dtype=np.int64)
+    dcenters = np.zeros((node_count, embed_dim), dtype=centers.dtype)
     for i in range(edge_count):
-        edge = edge_map[edges[i]]
-        n_u = edge[0]
-        n_v = edge[1]
-        n_u_ind = np.where(nodes == n_u)
-        n_v_ind = np.where(nodes == n_v)
-        X_uv = embeddings[i]
-        c_u = centers[n_u_ind]
-        c_v = centers[n_v_ind]
-        r_u = radii[n_u_ind]
-        r_v = radii[n_v_ind]
-        if np.linalg.norm(X_uv - c_u) > r_u:
-            dradii[n_u_ind] -= 2 * beta * r_u
-            dcenters[n_u_ind] += 2 * beta * (c_u - X_uv)
+        n_u = edge_idx[i, 0]
+        n_v = edge_idx[i, 1]
+        dist_u_sq = 0.0
+        dist_v_sq = 0.0
+        for k in range(embed_dim):
+            x = new_embeddings[i, k]
+            d_u = x - centers[n_u, k]
+            d_v = x - centers[n_v, k]
+            dist_u_sq += d_u * d_u
+            dist_v_sq += d_v * d_v
+        if dist_u_sq > radii_sq[n_u]:
+            violations[n_u] += 1
+            for k in range(embed_dim):
+                dcenters[n_u, k] += new_embeddings[i, k] - centers[n_u, k]
+        if dist_v_sq > radii_sq[n_v]:
+            violations[n_v] += 1
+            for k in range(embed_dim):
+                dcenters[n_v, k] += new_embeddings[i, k] - centers[n_v, k]
 
-        if np.linalg.norm(X_uv - c_v) > r_v:
-            dradii[n_v_ind] -= 2 * beta * r_v
-            dcenters[n_v_ind] += 2 * beta * (c_v - X_uv)
+    # Apply pass: each violated endpoint contributes -2*beta*r to its radius
+    # gradient, so the per-node term collapses to a violation count; the
+    # center gradient is -2*beta*dcenters, hence the sign flip on apply.
+    for n in prange(node_count):
+        r = radii[n, 0]
+        dr = (2.0 * alpha - 2.0 * beta * violations[n]) * r
+        if r < 0.0:
+            dr -= gamma[n]
+        radii[n, 0] = r - eta * dr
+        for k in range(embed_dim):
+            centers[n, k] += step * dcenters[n, k]
 
-    for i in range(node_count):
-        r_u = radii[i]
-        dradii[i] += 2 * alpha * r_u
-        if r_u < 0:
-            dradii[i] -= gamma[i]
 
-    radii -= eta * dradii
-    centers -= eta * dcenters
-
-    return centers, radii
\ No newline at end of file
+def fused_update(old_embeddings, new_embeddings, centers, radii, edge_idx, gamma, alpha=0.1, beta=0.1, eta=0.1):
+    # Signed square r*|r|: one N-sized pass instead of per-edge squaring
+    radii_sq = (radii * np.abs(radii)).ravel()
+    _fused_update_kernel(old_embeddings, new_embeddings, centers, radii, radii_sq, edge_idx,
+                         np.asarray(gamma, dtype=np.float64), alpha, beta, eta)
+    return new_embeddings